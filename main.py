@@ -6,14 +6,21 @@ movements, and display visuals.
 
 import json
 import logging
+import os
+import queue
 import sys
+import threading
+import time
+from functools import partial
 from pathlib import Path
+from types import ModuleType
+from typing import Callable
 
 import keyboard
 import mouse
 
 import midi
-from packaging import Keystroke
+from packaging import Keystroke, get_note_id
 from visuals import Display
 
 __author__ = "Ben Kraft"
@@ -36,11 +43,30 @@ class Defaults:
     PIANO_MODE = True
     KEY_LOG = True
     SENSITIVITY = 12
+    CURSOR_RATE = 60
+    MAX_CURSOR_DELAY = 0.1
+    POLL_RATE = 1000
+    INPUT_PRIORITY = 20
+
+
+def _get_cursor_moves(directions: list[tuple[int, int]]) -> tuple[tuple[int, int], ...]:
+    """
+    Sums directions for every combination of held cursor keybinds. Indexed by a
+    bitmask of the held keybinds.
+    """
+    moves: list[tuple[int, int]] = []
+    for mask in range(1 << len(directions)):
+        held = [
+            direction for bit, direction in enumerate(directions) if mask >> bit & 1
+        ]
+        moves.append((sum(x for x, _ in held), sum(y for _, y in held)))
+    return tuple(moves)
 
 
 class Keybinds:
     try:
-        _json = json.load(open(Paths.KEYBINDS, "r"))
+        with open(Paths.KEYBINDS, "r") as file:
+            _json = json.load(file)
     except FileNotFoundError:
         print(f"Keybinds file not found at {Paths.KEYBINDS}")
         sys.exit(1)
@@ -50,8 +76,27 @@ class Keybinds:
 
     KEYBOARD: dict[str, str] = _json["keyboard"]
     MOUSE: dict[str, str] = _json["mouse"]
-    CURSOR: dict[str, list[int]] = _json["cursor"]
-    QUIT: str = _json["quit"]
+    CURSOR: dict[str, tuple[int, int]] = {
+        note: (direction[0], direction[1])
+        for note, direction in _json["cursor"].items()
+    }
+    try:
+        # Maps note IDs to their device and hotkey, keyboard binds taking precedence
+        BUTTONS: dict[int, tuple[ModuleType, str]] = {
+            **{get_note_id(note): (mouse, hotkey) for note, hotkey in MOUSE.items()},
+            **{
+                get_note_id(note): (keyboard, hotkey)
+                for note, hotkey in KEYBOARD.items()
+            },
+        }
+        CURSOR_BITS: dict[int, int] = {
+            get_note_id(note): 1 << bit for bit, note in enumerate(CURSOR)
+        }
+        QUIT: int = get_note_id(_json["quit"])
+    except ValueError as e:
+        print(f"Invalid keybind in keybinds file at {Paths.KEYBINDS}: {e}")
+        sys.exit(1)
+    CURSOR_MOVES = _get_cursor_moves(list(CURSOR.values()))
 
 
 class Program:
@@ -61,7 +106,7 @@ class Program:
     Attributes:
         piano_mode: If keystokes will be displayed but not acted upon.
         key_log: If keystrokes will be logged.
-        sensitivity: How quickly the cursor moves when a key is held.
+        sensitivity: How far the cursor moves per cursor step when a key is held.
     """
 
     def __init__(
@@ -76,72 +121,157 @@ class Program:
         Args:
             piano_mode: If keystokes will be displayed but not acted upon.
             key_log: If keystrokes will be logged.
-            sensitivity: How quickly the cursor moves when a key is held.
+            sensitivity: How far the cursor moves per cursor step when a key is held.
         """
         self.piano_mode = piano_mode
         self.key_log = key_log
         self.sensitivity = sensitivity
+        self._cursor_mask = 0
+        self._cursor_time = time.perf_counter()
+        self._cursor_remainder = (0.0, 0.0)
         self._midi_device = midi.get_device()
         self._display = Display()
+        self._keystroke_queue: queue.SimpleQueue[Keystroke] = queue.SimpleQueue()
+        self._stop_event = threading.Event()
+        self._input_thread = threading.Thread(target=self._input_loop, daemon=True)
+        self._log_queue: queue.SimpleQueue[list[Keystroke] | None] = queue.SimpleQueue()
+        self._log_thread = threading.Thread(target=self._log_loop, daemon=True)
+        # Maps note IDs to handlers taking press state, so a note bound to both a
+        # button and a cursor direction acts on both
+        self._handlers: dict[int, list[Callable[[bool], None]]] = {}
+        for note_id, (device, hotkey) in Keybinds.BUTTONS.items():
+            self._handlers.setdefault(note_id, []).append(
+                partial(self._toggle_button, device, hotkey)
+            )
+        for note_id, bit in Keybinds.CURSOR_BITS.items():
+            self._handlers.setdefault(note_id, []).append(
+                partial(self._toggle_cursor, bit)
+            )
 
     def _process_keystroke(self, keystroke: Keystroke) -> None:
         """
         Toggles device if keystroke is in appropirate keybinds.
         """
-        # If key log is active, prints keystroke
-        if self.key_log:
-            logging.info(repr(keystroke))
-            print(repr(keystroke))
         # Returns early if piano mode
         if self.piano_mode:
             return
-        # If in list, presses corresponding keyboard button
-        if keystroke.full_note in Keybinds.KEYBOARD:
-            hotkey = Keybinds.KEYBOARD[keystroke.full_note]
-            keyboard.press(hotkey) if keystroke.press else keyboard.release(hotkey)
-        # If in list, presses corresponding mouse button
-        elif keystroke.full_note in Keybinds.MOUSE:
-            hotkey = Keybinds.MOUSE[keystroke.full_note]
-            mouse.press(hotkey) if keystroke.press else mouse.release(hotkey)
+        # If bound, passes press state to each of the keybind's handlers
+        for handler in self._handlers.get(keystroke.note_id, ()):
+            handler(keystroke.press)
+
+    def _toggle_button(self, device: ModuleType, hotkey: str, press: bool) -> None:
+        """
+        Presses or releases keyboard or mouse button.
+        """
+        device.press(hotkey) if press else device.release(hotkey)
+
+    def _toggle_cursor(self, bit: int, press: bool) -> None:
+        """
+        Holds or releases cursor direction.
+        """
+        if press:
+            self._cursor_mask |= bit
+        else:
+            self._cursor_mask &= ~bit
+
+    def _log_keystrokes(self, keystrokes: list[Keystroke]) -> None:
+        """
+        Queues keystrokes to be logged and printed off the display thread.
+        """
+        self._log_queue.put(keystrokes)
+
+    def _log_loop(self) -> None:
+        """
+        Logs and prints queued keystrokes with a single write each, until
+        sent None.
+        """
+        while (keystrokes := self._log_queue.get()) is not None:
+            key_log = "\n".join(repr(keystroke) for keystroke in keystrokes)
+            logging.info(key_log)
+            print(key_log)
 
     def _process_cursor(self) -> None:
         """
-        Moves mouse based on held directions.
+        Moves mouse based on held directions, scaled by time elapsed since the
+        last call so cursor speed does not depend on tick timing.
         """
-        # Returns early if no held keys
-        if not self._display.held_keystrokes:
-            return
-        # Gets held directions as integer lists from display
-        held_directions = [
-            Keybinds.CURSOR[keystroke.full_note]
-            for keystroke in self._display.held_keystrokes
-            if keystroke.full_note in Keybinds.CURSOR
-        ]
-        # Returns early if no held directions
-        if not held_directions:
+        # Measures elapsed time, capped so a stall does not cause a jump
+        now = time.perf_counter()
+        elapsed = min(now - self._cursor_time, Defaults.MAX_CURSOR_DELAY)
+        self._cursor_time = now
+        # Looks up summed held directions
+        sum_x, sum_y = Keybinds.CURSOR_MOVES[self._cursor_mask]
+        # Returns early if no held directions or if they cancel out
+        if not sum_x and not sum_y:
+            self._cursor_remainder = (0.0, 0.0)
             return
-        # Sums and scales directions
-        move_x, move_y = (
-            sum(axis) * self.sensitivity for axis in zip(*held_directions)
-        )
+        # Scales directions, carrying fractional pixels to the next move
+        steps = self.sensitivity * elapsed * Defaults.CURSOR_RATE
+        exact_x = sum_x * steps + self._cursor_remainder[0]
+        exact_y = sum_y * steps + self._cursor_remainder[1]
+        move_x, move_y = round(exact_x), round(exact_y)
+        self._cursor_remainder = (exact_x - move_x, exact_y - move_y)
         # Moves mouse in direction
-        mouse.move(move_x, move_y, False, 0)
+        if move_x or move_y:
+            mouse.move(move_x, move_y, False, 0)
+
+    def _input_loop(self) -> None:
+        """
+        Polls MIDI device until stopped. Acts on keystrokes as soon as they are
+        read, then queues them for the display. Stops the program on exit, so
+        the display loop never outlives its input.
+        """
+        try:
+            while not self._stop_event.is_set():
+                # Reads until device is drained
+                while keystrokes := midi.get_keystrokes(self._midi_device):
+                    for keystroke in keystrokes:
+                        if not self.piano_mode and keystroke.note_id == Keybinds.QUIT:
+                            print("\nExiting via key...")
+                            return
+                        self._process_keystroke(keystroke)
+                        self._keystroke_queue.put(keystroke)
+                # Waits until next poll unless stopped
+                self._stop_event.wait(1 / Defaults.POLL_RATE)
+        finally:
+            self._stop_event.set()
+
+    def _start_input(self) -> None:
+        """
+        Starts input loop on its own thread, with real-time scheduling priority
+        where the platform and permissions allow it.
+        """
+        self._input_thread.start()
+        try:
+            os.sched_setscheduler(  # type: ignore
+                self._input_thread.native_id,
+                os.SCHED_FIFO,  # type: ignore
+                os.sched_param(Defaults.INPUT_PRIORITY),  # type: ignore
+            )
+        except (AttributeError, OSError):
+            logging.info("Input loop running at default priority")
 
     def _logic_tick(self) -> bool:
         """
         Runs program logic loop. Returns false if loop should stop.
         """
-        # Gets keystroke
-        keystrokes = midi.get_keystrokes(self._midi_device)
+        # Returns early if input loop has stopped
+        if self._stop_event.is_set():
+            return False
+        # Gets keystrokes queued by input loop
+        keystrokes: list[Keystroke] = []
+        try:
+            while True:
+                keystrokes.append(self._keystroke_queue.get_nowait())
+        except queue.Empty:
+            pass
         # Processes keystrokes if populated
         if keystrokes:
-            for keystroke in keystrokes:
-                if keystroke.full_note == Keybinds.QUIT and not self.piano_mode:
-                    print("\nExiting via key...")
-                    return False
-                self._process_keystroke(keystroke)
-                # Updates display with keystroke
-                self._display.update_key(keystroke, update=False)
+            # If key log is active, prints keystrokes
+            if self.key_log:
+                self._log_keystrokes(keystrokes)
+            # Updates display with all keystrokes
+            self._display.update_keys(keystrokes, update=False)
         # Processes held cursor movements
         if not self.piano_mode:
             self._process_cursor()
@@ -149,8 +279,8 @@ class Program:
         if self._display.is_closed():
             print("\nExiting via display...")
             return False
-        # Refreshes display
-        self._display.refresh()
+        # Refreshes display if keys have changed
+        self._display.refresh_if_changed()
         self._display.tick()
         return True
 
@@ -160,6 +290,9 @@ class Program:
         Updates display with keystrokes and moves cursor based on held directions.
         """
         try:
+            if self.key_log:
+                self._log_thread.start()
+            self._start_input()
             run = True
             # Runs logic loop unless stopped
             while run:
@@ -170,6 +303,14 @@ class Program:
             self.close()
 
     def close(self):
+        # Stops input loop before closing its device
+        self._stop_event.set()
+        if self._input_thread.is_alive():
+            self._input_thread.join()
+        # Writes remaining logs before exiting
+        if self._log_thread.is_alive():
+            self._log_queue.put(None)
+            self._log_thread.join()
         self._midi_device.close()
         self._display.close()
 
@@ -10,11 +10,11 @@ import pygame.midi
 os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "hide"
 import pygame
 
-from packaging import Keystroke
+from packaging import KEYSTROKES, Keystroke, get_keystroke
 
 
 class Defaults:
-    MIDI_READS = 3
+    MIDI_READS = 64
 
 
 def get_device(list_all: bool = True) -> pygame.midi.Input:
@@ -57,19 +57,22 @@ def get_device_info(device_index: int) -> tuple[str, bool]:
 
 def parse_event(event: list[int]) -> Keystroke:
     """
-    Parses midi event into keystroke.
+    Parses midi event into keystroke, shared if within MIDI note range.
     """
+    if 0 <= event[1] < 128:
+        return get_keystroke(event[1], event[2] != 64)
     note_index = event[1]
-    velocity = event[2]
-    return Keystroke(Keystroke.NOTES[note_index % 12], note_index // 12, velocity != 64)
+    return Keystroke(Keystroke.NOTES[note_index % 12], note_index // 12, event[2] != 64)
 
 
 def get_keystrokes(
-    midi_device: pygame.midi.Input, midi_reads: int = Defaults.MIDI_READS
+    midi_device: pygame.midi.Input,
+    midi_reads: int = Defaults.MIDI_READS,
 ) -> list[Keystroke]:
     """
     Attempts to read a specified number of MIDI events from the device. Filters
-    out clock events and empty velocities, then returns the corresponding keystrokes.
+    out all but note on and off events and empty velocities, then returns the
+    corresponding keystrokes.
 
     Args:
         midi_device: A pygame.midi.Input instance representing the MIDI input device.
@@ -79,20 +82,18 @@ def get_keystrokes(
         A list of Keystroke objects parsed from the MIDI events.
     """
     try:
-        # Returns early if device has no events
-        if not midi_device.poll():
-            return []
-        # Accesses events from device in format:
+        # Accesses events from device in format, empty if device has no events:
         # [[[status, note, velocity, data_3], timestamp], ...]
         midi_events: list[list[list[int], int]] = midi_device.read(midi_reads)  # type: ignore
-        # Strips timestamp
-        untimed_events = [event[0] for event in midi_events]
-        # Filters out clock events and empty velocities and parses into keystrokes
-        return [
-            parse_event(event)
-            for event in untimed_events
-            if event[0] != 248 and event[2] != 0
-        ]
+    # Without a poll, device errors are raised unwrapped by the read itself
     except Exception as e:
         print(f"Error: {e}")
         return []
+    # Strips timestamps, keeps note on and off events (0x80-0x9F on any channel)
+    # with nonempty velocities and indexes shared keystrokes directly, all in
+    # one pass
+    return [
+        KEYSTROKES[note_index << 1 | (velocity != 64)]
+        for (status, note_index, velocity, _), _ in midi_events
+        if 0x80 <= status < 0xA0 and velocity != 0
+    ]
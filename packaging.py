@@ -22,10 +22,13 @@ class Keystroke:
         octave: The absolute octave for the note.
         press: Whether the key is pressed (True) or released (False).
         full_note: A string combining the note and the octave.
+        note_id: An integer combining the note and the octave (MIDI note index).
         ACTIONS: The available actions.
         NOTES: The available musical notes ('C' through 'B').
     """
 
+    __slots__ = ("note", "octave", "press", "full_note", "note_id", "_inverted")
+
     # Defines action and note constants
     ACTIONS = ("release", "press")
     NOTES = ("C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B")
@@ -43,15 +46,37 @@ class Keystroke:
             ValueError: If the note is not a valid musical note.
         """
         self.note = note.upper()
-        if self.note not in self.NOTES:
+        note_position = _NOTE_POSITIONS.get(self.note)
+        if note_position is None:
             raise ValueError(
                 f"Invalid note: {self.note}, available notes: {self.NOTES}"
             )
         if octave < 0:
-            raise ValueError(f"Invalid octave: {self.octave}")
+            raise ValueError(f"Invalid octave: {octave}")
         self.octave = octave
         self.press = press
         self.full_note = self.note + str(self.octave)
+        self.note_id = octave * 12 + note_position
+        self._inverted: Keystroke | None = None
+
+    @classmethod
+    def from_index(cls, note_index: int, press: bool = True) -> "Keystroke":
+        """
+        Creates a Keystroke from a MIDI note index (0-127). Skips validation and
+        reads the note and full note from precomputed tables.
+
+        Args:
+            note_index: The MIDI note index (octave * 12 + note position).
+            press: Whether the key is pressed (True) or released (False).
+        """
+        keystroke = cls.__new__(cls)
+        keystroke.octave, note_position = divmod(note_index, 12)
+        keystroke.note = cls.NOTES[note_position]
+        keystroke.press = press
+        keystroke.full_note = _FULL_NOTES[note_index]
+        keystroke.note_id = note_index
+        keystroke._inverted = None
+        return keystroke
 
     def __str__(self) -> str:
         return self.full_note
@@ -66,23 +91,74 @@ class Keystroke:
 
     def __eq__(self, other: object) -> bool:
         """
-        Compares two Keystroke objects for equality, based on the full_note.
+        Compares two Keystroke objects for equality, based on the note_id.
         """
         if isinstance(other, Keystroke):
-            return self.full_note == other.full_note
+            return self.note_id == other.note_id
         return False
 
     def __hash__(self) -> int:
         """
-        Returns the hash of the Keystroke, based on the full_note.
+        Returns the hash of the Keystroke, based on the note_id.
         """
-        return hash(self.full_note)
+        return self.note_id
 
-    def inverted(self):
+    def inverted(self) -> "Keystroke":
         """
-        Returns a new instance of Keystroke with the action inverted (pressed/released).
+        Returns an instance of Keystroke with the action inverted (pressed/released).
+        Built once, then shared with its inverse.
         """
-        return Keystroke(self.note, self.octave, not self.press)
+        if self._inverted is None:
+            self._inverted = Keystroke(self.note, self.octave, not self.press)
+            self._inverted._inverted = self
+        return self._inverted
+
+
+# Position of each note within an octave
+_NOTE_POSITIONS = {note: position for position, note in enumerate(Keystroke.NOTES)}
+
+# Full note strings for every MIDI note index
+_FULL_NOTES = tuple(f"{Keystroke.NOTES[i % 12]}{i // 12}" for i in range(128))
+
+
+def _build_keystroke_table() -> tuple[Keystroke, ...]:
+    """
+    Builds every MIDI keystroke once, indexed by note index and press state.
+    """
+    table: list[Keystroke] = []
+    for note_index in range(128):
+        press = Keystroke.from_index(note_index)
+        release = Keystroke.from_index(note_index, False)
+        press._inverted, release._inverted = release, press
+        table.extend((release, press))
+    return tuple(table)
+
+
+# Shared keystrokes, indexed by note index << 1 | press
+KEYSTROKES = _build_keystroke_table()
+
+# MIDI note index for every full note string
+_NOTE_IDS = {full_note: note_id for note_id, full_note in enumerate(_FULL_NOTES)}
+
+
+def get_keystroke(note_index: int, press: bool = True) -> Keystroke:
+    """
+    Returns shared keystroke for a MIDI note index (0-127) and press state.
+    """
+    return KEYSTROKES[note_index << 1 | press]
+
+
+def get_note_id(full_note: str) -> int:
+    """
+    Returns MIDI note index for a full note string (e.g., 'C#4').
+
+    Raises:
+        ValueError: If the full note is not a valid MIDI note.
+    """
+    note_id = _NOTE_IDS.get(full_note.upper())
+    if note_id is None:
+        raise ValueError(f"Invalid full note: {full_note}")
+    return note_id
 
 
 if __name__ == "__main__":
@@ -4,10 +4,15 @@ A small module used to manipulate, animate, and export frames from a `Display`
 as .png's, .gif's, etc.
 """
 
+import functools
+import itertools
 import os
 import shutil
+import sys
 from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
+from typing import Iterator
 
 os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "hide"
 
@@ -31,12 +36,14 @@ EXPORT_DIRECTORY_PATH = Paths.ASSETS / "export"
 NUM_KEYS_PRESSED = 25
 
 SAVE_IMAGES = False
+OPTIMIZE_GIF = False
+QUANTIZE_THREADS = os.cpu_count() or 2
 FRAMES_PER_SECOND = 50
 MILLISECONDS_PER_FRAME = 1000 / FRAMES_PER_SECOND
 if MILLISECONDS_PER_FRAME < 20:
     raise ValueError("FPS too high!")
 
-index = 0
+frame_numbers = itertools.count()
 
 
 def main() -> None:
@@ -44,91 +51,191 @@ def main() -> None:
     Exports animation as gif under specified path.
     """
     display = Display(num_octaves=6, scale=1)
-    frames: list[Image.Image] = []
+    palette = get_palette(display)
+    # Keystrokes drawn for each frame, rendered only as the encoder needs them
+    animation: list[tuple[Keystroke, ...]] = []
 
     empty_directory(EXPORT_DIRECTORY_PATH)
 
-    # return
-    keystroke_history: deque[Keystroke] = deque([], maxlen=NUM_KEYS_PRESSED)
+    # Builds pressed and released keystrokes for every displayed note once
+    presses = tuple(
+        Keystroke(note, octave + display.starting_octave)
+        for octave in range(display.num_octaves)
+        for note in Keystroke.NOTES
+    )
+    releases = tuple(keystroke.inverted() for keystroke in presses)
 
-    # For each octave:
-    for octave in range(display.num_octaves):
-        # For each note index:
-        for note in Keystroke.NOTES:
-            # Creates keystroke
-            keystroke = Keystroke(note, octave + display.starting_octave)
-            # If keystroke history is full:
-            if len(keystroke_history) == NUM_KEYS_PRESSED:
-                # Accesses and inverts keystroke from DISTANCE ago
-                display._draw_keystroke(keystroke_history[0].inverted())
-            # Updates display with keystroke
-            display._draw_keystroke(keystroke)
-            # Adds window image to frames
-            frames.append(get_image(display))
-            # Adds keystroke to history
-            keystroke_history.append(keystroke)
+    # For each displayed note:
+    for index, press in enumerate(presses):
+        # Releases keystroke from DISTANCE ago alongside new keystroke
+        if index >= NUM_KEYS_PRESSED:
+            animation.append((releases[index - NUM_KEYS_PRESSED], press))
+        else:
+            animation.append((press,))
 
-    # For each keystroke in remaining history:
-    for keystroke in keystroke_history:
-        # Updates display with keystroke
-        display._draw_keystroke(keystroke.inverted())
-        # Adds window image to frames
-        frames.append(get_image(display))
+    # Releases remaining held keystrokes
+    for release in releases[-NUM_KEYS_PRESSED:]:
+        animation.append((release,))
 
-    export_as_gif(frames, EXPORT_DIRECTORY_PATH / "demo.gif")
+    export_as_gif(
+        render_frames(display, animation, palette),
+        EXPORT_DIRECTORY_PATH / "demo.gif",
+    )
 
-    frames.reverse()
+    export_as_gif(
+        render_frames(display, reverse_animation(animation), palette),
+        EXPORT_DIRECTORY_PATH / "demo_reversed.gif",
+    )
 
-    export_as_gif(frames, EXPORT_DIRECTORY_PATH / "demo_reversed.gif")
+    display.close()
+
+
+def reverse_animation(
+    animation: list[tuple[Keystroke, ...]]
+) -> list[tuple[Keystroke, ...]]:
+    """
+    Returns animation played backwards. The first frame replays every keystroke
+    to reach the final state, then each frame undoes the one after it.
+    """
+    reversed_animation = [tuple(k for keystrokes in animation for k in keystrokes)]
+    for keystrokes in itertools.islice(reversed(animation), len(animation) - 1):
+        reversed_animation.append(tuple(k.inverted() for k in reversed(keystrokes)))
+    return reversed_animation
 
 
-def export_as_gif(frames: list[Image.Image], path: Path) -> None:
+def render_frames(
+    display: Display, animation: list[tuple[Keystroke, ...]], palette: Image.Image
+) -> Iterator[Image.Image]:
+    """
+    Draws animation onto a refreshed display, yielding each frame once drawn.
+    Frames are quantized on worker threads while the next ones are drawn.
     """
-    Exports frames as gif under specified path.
+    display.refresh()
+    with ThreadPoolExecutor(max_workers=QUANTIZE_THREADS) as executor:
+        pending: deque[Future[Image.Image]] = deque()
+        # Binds methods used every frame
+        update_keys, submit = display.update_keys, executor.submit
+        push, pop = pending.append, pending.popleft
+        for keystrokes in animation:
+            update_keys(keystrokes)
+            # Snapshots window before next draw, then quantizes in background
+            push(submit(quantize_image, get_window_image(display), palette))
+            if len(pending) > QUANTIZE_THREADS:
+                yield get_frame(pop())
+        while pending:
+            yield get_frame(pending.popleft())
+
+
+def export_as_gif(frames: Iterator[Image.Image], path: Path) -> None:
     """
-    frames[0].save(
+    Exports frames as gif under specified path, consuming them one at a time.
+    """
+    next(frames).save(
         path,
         save_all=True,
-        append_images=frames[1:],
+        append_images=frames,
         duration=MILLISECONDS_PER_FRAME,
+        optimize=OPTIMIZE_GIF,
         loop=0,
     )
 
 
-def get_image(display: Display, save_image: bool = SAVE_IMAGES) -> Image.Image:
+def get_palette(display: Display) -> Image.Image:
+    """
+    Gets a palette image holding every color the display can draw, sampled from
+    a frame with every note pressed. Leaves the display refreshed.
+    """
+    # Draws every pressed key over the first octave
+    for note in Keystroke.NOTES:
+        display._draw_keystroke(Keystroke(note, display.starting_octave))
+    # Samples colors from window
+    sample = get_window_image(display)
+    # Clears pressed keys from display
+    display.refresh()
+    return sample.quantize(colors=256, method=Image.Quantize.MEDIANCUT)
+
+
+def quantize_image(image: Image.Image, palette: Image.Image) -> Image.Image:
     """
-    Gets current window image and saves if specified.
+    Maps image onto fixed palette, one byte per pixel.
     """
-    # Converts display surface to string
-    string_data = pygame.image.tostring(display._window, "RGBA")
-    # Creates image from string
-    image = Image.frombytes("RGBA", display._window.get_size(), string_data)
+    return image.quantize(palette=palette, dither=Image.Dither.NONE)
+
+
+def get_frame(
+    frame: Future[Image.Image], save_image: bool = SAVE_IMAGES
+) -> Image.Image:
+    """
+    Waits for quantized frame and saves if specified.
+    """
+    image = frame.result()
     # Saves image if specified
     if save_image:
-        global index
-        image.save(EXPORT_DIRECTORY_PATH / f"{index:04}.png")
-        index += 1
+        image.save(EXPORT_DIRECTORY_PATH / f"{next(frame_numbers):04}.png")
+    return image
+
+
+def get_window_image(display: Display) -> Image.Image:
+    """
+    Gets a copy of the current window image, decoded straight from the surface
+    pixels without an intermediate bytes copy.
+    """
+    window = display._window
+    # Falls back to a bytes copy for non 32-bit surfaces
+    if window.get_bytesize() != 4:
+        pixel_data = pygame.image.tobytes(window, "RGB")
+        return Image.frombytes("RGB", window.get_size(), pixel_data)
+    # Decodes a copy from a view of the surface
+    view = window.get_view("2")
+    image = Image.frombytes(
+        "RGB",
+        window.get_size(),
+        view,
+        "raw",
+        get_raw_mode(window.get_shifts()),
+        window.get_pitch(),
+        1,
+    )
+    # Releases view so the window is unlocked for drawing
+    del view
     return image
 
 
-def empty_directory(directory_path: Path) -> None:
+@functools.cache
+def get_raw_mode(shifts: tuple[int, int, int, int]) -> str:
+    """
+    Returns Pillow raw mode matching the channel shifts of a 32-bit surface.
+    """
+    channels = ["X"] * 4
+    for channel, shift in zip("RGB", shifts):
+        byte = shift // 8
+        channels[byte if sys.byteorder == "little" else 3 - byte] = channel
+    return "".join(channels)
+
+
+def empty_directory(directory_path: Path, verbose: bool = False) -> None:
     """
-    Empties directory if it exists.
+    Empties directory if it exists. Prints each deleted item if verbose.
     """
     try:
         # Check if the directory exists
-        if directory_path.exists() and directory_path.is_dir():
-            # Iterate over all items in the directory
-            for item in directory_path.iterdir():
-                # Check if the item is a file or a symbolic link
-                if item.is_file() or item.is_symlink():
-                    item.unlink()
-                    print(f"File '{item.name}' deleted.")
-                # If the item is a directory, remove it recursively
-                elif item.is_dir():
-                    shutil.rmtree(item)  # Remove directory and its contents
-                    print(f"Directory '{item.name}' deleted.")
-            print(f"Directory '{directory_path.name}' is now empty.")
+        if directory_path.is_dir():
+            count = 0
+            # Iterate over all entries, reusing their cached stat results
+            with os.scandir(directory_path) as entries:
+                for entry in entries:
+                    # If the entry is a directory, remove it recursively
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path)
+                        if verbose:
+                            print(f"Directory '{entry.name}' deleted.")
+                    # Otherwise removes file or symbolic link
+                    else:
+                        os.unlink(entry.path)
+                        if verbose:
+                            print(f"File '{entry.name}' deleted.")
+                    count += 1
+            print(f"Directory '{directory_path.name}' is now empty ({count} deleted).")
         else:
             print(f"Directory '{directory_path.name}' does not exist.")
 
@@ -5,11 +5,15 @@ Allows for the creation of piano display windows, to be updated with key presses
 
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Iterable
 
 from PIL import Image
 
 os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "hide"
+# Filters window scaling bilinearly unless set otherwise
+os.environ.setdefault("SDL_RENDER_SCALE_QUALITY", "1")
 import pygame
 
 from packaging import Keystroke
@@ -33,6 +37,8 @@ class Defaults:
     STARTING_OCTAVE = 3
     SCALE = 1
     FRAME_RATE = 60
+    SPIN_TIME = 0.001
+    LOAD_THREADS = 4
     BACKGROUND_COLOR = (0, 255, 0)
 
 
@@ -46,6 +52,17 @@ class Paths:
     ICON = ASSETS / "icon.png"
 
 
+def _read_image(path: Path) -> pygame.Surface:
+    """
+    Decodes image from path. Safe to call off the display thread.
+    """
+    try:
+        return pygame.image.load(path)
+    except FileNotFoundError:
+        print(f"Cannot load image: {path}")
+        raise SystemExit
+
+
 class Display:
     """
     A window display to render a piano and key presses when they occur.
@@ -57,6 +74,27 @@ class Display:
         background_color: RGB tuple of the display's background color.
     """
 
+    __slots__ = (
+        "num_octaves",
+        "starting_octave",
+        "scale",
+        "background_color",
+        "_next_tick",
+        "_changed",
+        "_image_memory",
+        "_background_key",
+        "_held_mask",
+        "_window",
+        "_key_bounds",
+        "_key_areas",
+        "_key_atlas",
+        "_key_scale",
+        "_octave_size",
+        "_octave_rects",
+        "_key_rects",
+        "_background",
+    )
+
     def __init__(
         self,
         num_octaves: int = Defaults.NUM_OCTAVES,
@@ -79,15 +117,23 @@ class Display:
         self.starting_octave = starting_octave
         self.scale = scale
         self.background_color = background_color
-        self._clock = pygame.time.Clock()
+        self._next_tick = time.perf_counter()
         self.clear_memory()
 
-        with Image.open(Paths.OCTAVE) as image:
-            self._set_window_size(image.size)
-        # Loads key images to memory preemptively
-        for action in Keystroke.ACTIONS:
-            for note in Keystroke.NOTES:
-                self._load_image(self._get_image_path(note, action), cache=True)
+        key_paths = self._get_key_paths()
+        with ThreadPoolExecutor(max_workers=Defaults.LOAD_THREADS) as executor:
+            # Decodes key images in background while window is created
+            key_images = executor.map(_read_image, key_paths)
+            with Image.open(Paths.OCTAVE) as image:
+                self._set_window_size(image.size)
+            # Queues only quit and expose events, the only ones the display handles
+            pygame.event.set_blocked(None)
+            pygame.event.set_allowed([pygame.QUIT, pygame.WINDOWEXPOSED])
+            # Loads key images to memory preemptively, indexed by press state and note
+            self._load_key_atlas(
+                self._load_image(path, image=image)
+                for path, image in zip(key_paths, key_images)
+            )
         # Adds a title and iconto display
         pygame.display.set_caption("Piano Display")
         pygame.display.set_icon(self._load_image(Paths.ICON))
@@ -98,67 +144,155 @@ class Display:
         """
         Clears image and keystroke memory.
         """
-        self._image_memory: dict[Path, pygame.Surface] = {}
-        self.held_keystrokes: set[Keystroke] = set()
-
-    def _load_image(self, path: Path, cache: bool = False) -> pygame.Surface:
-        """
-        Loads image from path. Returns scaled image surface.
-        """
-        # Accesses if in memory
-        if path in self._image_memory:
-            image = self._image_memory[path]
-        # Loads from image path
-        else:
-            try:
-                image = pygame.image.load(path).convert_alpha()
-            except FileNotFoundError:
-                print(f"Cannot load image: {path}")
-                raise SystemExit
-            # Adds to memory if specified
-            if cache:
-                self._image_memory[path] = image
-        # Gets scaled image size
-        scaled_size = tuple(dimension * self.scale for dimension in image.get_size())
-        # Returns scaled image
-        return pygame.transform.scale(image, scaled_size)
-
-    def _draw_image_at(
-        self, image: pygame.Surface, octave: int, update: bool = False
-    ) -> None:
+        self._image_memory: dict[tuple[Path, float], pygame.Surface] = {}
+        self._background_key: tuple[tuple[int, int, int], float, int] | None = None
+        # Held notes as bits indexed by note ID
+        self._held_mask = 0
+        # Marks display as changed so cleared keys are redrawn
+        self._changed = True
+
+    @property
+    def held_keystrokes(self) -> set[Keystroke]:
+        """
+        Returns pressed keystrokes for all currently held notes.
+        """
+        return {
+            Keystroke(Keystroke.NOTES[note_id % 12], note_id // 12)
+            for note_id in range(self._held_mask.bit_length())
+            if self._held_mask >> note_id & 1
+        }
+
+    def _load_image(
+        self, path: Path, cache: bool = False, image: pygame.Surface | None = None
+    ) -> pygame.Surface:
+        """
+        Loads image from path, or from its already decoded image if given.
+        Returns scaled image surface, converted and scaled once then reused if
+        cached at the current scale.
         """
-        Draws surface at specified octave. Updates surface if specified.
+        # Accesses if in memory at current scale
+        key = (path, self.scale)
+        if key in self._image_memory:
+            return self._image_memory[key]
+        # Loads from image path if not already decoded
+        if image is None:
+            image = _read_image(path)
+        image = image.convert_alpha()
+        # Scales image with filtering if needed
+        if self.scale != 1:
+            width, height = image.get_size()
+            scaled_size = (round(width * self.scale), round(height * self.scale))
+            image = pygame.transform.smoothscale(image, scaled_size)
+        # Adds to memory if specified
+        if cache:
+            self._image_memory[key] = image
+        return image
+
+    def _draw_keystroke(
+        self, keystroke: Keystroke, update: bool = False
+    ) -> pygame.Rect | None:
         """
-        # Creates rectangle size of octave surface at relative position
-        rectangle = pygame.Rect((octave * self._octave_size[0], 0), self._octave_size)
-        # Draws surface in location of rectangle
-        self._window.blit(image, rectangle)
+        Draws key on display. Updates surface if specified. Returns drawn rectangle,
+        or None if key is off-screen.
+        """
+        # Skips keys outside displayed octaves
+        if not self._is_on_screen(keystroke.note_id):
+            return None
+        image, rectangle, area, flags = self._get_key_blit(
+            keystroke.note_id, keystroke.press
+        )
+        # Draws key at relative octave
+        self._window.blit(image, rectangle, area, flags)
         # If specified, updates display at rectangle
         if update:
             pygame.display.update(rectangle)
+        return rectangle
 
-    def _draw_keystroke(self, keystroke: Keystroke, update: bool = False) -> None:
+    def _load_key_atlas(self, key_images: Iterable[pygame.Surface]) -> None:
         """
-        Draws key on display. Updates surface if specified.
+        Packs the visible area of every key image side by side into one
+        premultiplied atlas. Records each key's area in the atlas and its bounds
+        within an octave, at the current scale.
         """
-        # Gets image from keystroke
-        path = self._get_image_path(keystroke.note, Keystroke.ACTIONS[keystroke.press])
-        # Draws key at relative octave
-        self._draw_image_at(
-            self._load_image(path), keystroke.octave - self.starting_octave, update
+        self._key_scale = self.scale
+        self._key_bounds: list[pygame.Rect] = []
+        self._key_areas: list[pygame.Rect] = []
+        key_crops: list[pygame.Surface] = []
+        # Crops transparent margins from each key image
+        for image in key_images:
+            bounds = image.get_bounding_rect()
+            self._key_bounds.append(bounds)
+            key_crops.append(image.subsurface(bounds))
+        # Copies crops into atlas, left to right
+        atlas = pygame.Surface(
+            (
+                sum(crop.get_width() for crop in key_crops),
+                max(crop.get_height() for crop in key_crops),
+            ),
+            pygame.SRCALPHA,
+        ).convert_alpha()
+        x = 0
+        for crop in key_crops:
+            # Takes maximum over transparent atlas to copy pixels unblended
+            self._key_areas.append(
+                atlas.blit(crop, (x, 0), special_flags=pygame.BLEND_RGBA_MAX)
+            )
+            x += crop.get_width()
+        self._key_atlas = atlas.premul_alpha()
+
+    def _get_key_blit(
+        self, note_id: int, press: bool
+    ) -> tuple[pygame.Surface, pygame.Rect, pygame.Rect, int]:
+        """
+        Returns key atlas, rectangle of on-screen key within its relative octave,
+        area of key in atlas, and blend flags, as accepted by Surface.blits.
+        """
+        key_index = press * 12 + note_id % 12
+        return (
+            self._key_atlas,
+            self._key_rects[note_id // 12 - self.starting_octave][key_index],
+            self._key_areas[key_index],
+            pygame.BLEND_PREMULTIPLIED,
         )
 
+    def _is_on_screen(self, note_id: int) -> bool:
+        """
+        Returns true if note is within displayed octaves.
+        """
+        return 0 <= note_id // 12 - self.starting_octave < len(self._key_rects)
+
     def update_key(self, keystroke: Keystroke, update: bool = True) -> None:
         """
         Updates held keystrokes with new keystroke. Updates surface if specified.
         """
-        # Adds or removes from held keys
-        if keystroke not in self.held_keystrokes and keystroke.press:
-            self.held_keystrokes.add(keystroke)
-        elif keystroke in self.held_keystrokes and not keystroke.press:
-            self.held_keystrokes.remove(keystroke)
-        # Draws individual keystroke
-        self._draw_keystroke(keystroke, update)
+        self.update_keys((keystroke,), update)
+
+    def update_keys(self, keystrokes: Iterable[Keystroke], update: bool = True) -> None:
+        """
+        Updates held keystrokes with new keystrokes, skipping any that do not
+        change a key's state. If specified, updates all drawn areas of the
+        surface at once.
+        """
+        key_blits: list[tuple[pygame.Surface, pygame.Rect, pygame.Rect, int]] = []
+        for keystroke in keystrokes:
+            # Skips keystroke if key is already in that state
+            bit = 1 << keystroke.note_id
+            if bool(self._held_mask & bit) == keystroke.press:
+                continue
+            # Adds or removes from held keys
+            self._held_mask ^= bit
+            # Draws only keys within displayed octaves
+            if self._is_on_screen(keystroke.note_id):
+                key_blits.append(self._get_key_blit(keystroke.note_id, keystroke.press))
+        # Returns early if no keystrokes
+        if not key_blits:
+            return
+        # Draws all keystrokes in one call, marking display as changed
+        self._window.blits(key_blits, doreturn=False)
+        self._changed = True
+        # Updates display once for all drawn keys
+        if update:
+            pygame.display.update([key_blit[1] for key_blit in key_blits])
 
     def _get_image_path(self, note: str, action: str) -> Path:
         """
@@ -166,40 +300,123 @@ class Display:
         """
         return Paths.ASSETS / action / f"{note}.png"
 
+    def _get_key_paths(self) -> list[Path]:
+        """
+        Returns paths of all key images, indexed by press state and note.
+        """
+        return [
+            self._get_image_path(note, action)
+            for action in Keystroke.ACTIONS
+            for note in Keystroke.NOTES
+        ]
+
     def _set_window_size(self, octave_size: tuple[int, int]) -> None:
         """
-        Sets display window size from octave size.
+        Sets display window size from octave size. Presents through an SDL
+        renderer, scaling the window on high resolution displays.
         """
-        self._window = pygame.display.set_mode(
-            (octave_size[0] * self.num_octaves, octave_size[1]),
-            # pygame.RESIZABLE,
-        )
+        window_size = (octave_size[0] * self.num_octaves, octave_size[1])
+        try:
+            self._window = pygame.display.set_mode(
+                window_size, pygame.SCALED | pygame.DOUBLEBUF
+            )
+        # Falls back to an unscaled window if no renderer can be created
+        except pygame.error:
+            self._window = pygame.display.set_mode(window_size)
 
     def refresh(self) -> None:
         """
         Draws piano and keys on display screen.
         """
-        # Defines octave surface
-        octave_image = self._load_image(Paths.OCTAVE, cache=True)
-        self._octave_size = octave_image.get_size()
-        # Fills screen with background color
-        self._window.fill(self.background_color)
-        # Draws base piano
-        for octave in range(self.num_octaves):
-            self._draw_image_at(octave_image, octave)
-        # Draws all held keys
-        for keystroke in self.held_keystrokes:
-            self._draw_keystroke(keystroke)
+        # Draws base piano over background in one blit
+        self._window.blit(self._get_background(), (0, 0))
+        # Draws all held keys in one call, scanning held bits of displayed
+        # octaves from lowest note
+        key_blits: list[tuple[pygame.Surface, pygame.Rect, pygame.Rect, int]] = []
+        first_note_id = self.starting_octave * 12
+        held_mask = self._held_mask >> first_note_id
+        held_mask &= (1 << len(self._key_rects) * 12) - 1
+        while held_mask:
+            lowest_bit = held_mask & -held_mask
+            note_id = first_note_id + lowest_bit.bit_length() - 1
+            key_blits.append(self._get_key_blit(note_id, True))
+            held_mask ^= lowest_bit
+        self._window.blits(key_blits, doreturn=False)
         # Updates the full display
         pygame.display.flip()
+        self._changed = False
+
+    def refresh_if_changed(self) -> bool:
+        """
+        Refreshes display only if keys were updated or the window was exposed
+        since the last refresh. Returns true if refreshed.
+        """
+        if pygame.event.get(pygame.WINDOWEXPOSED):
+            self._changed = True
+        if not self._changed:
+            return False
+        self.refresh()
+        return True
+
+    def _get_background(self) -> pygame.Surface:
+        """
+        Returns base piano composited over the background color, as an opaque
+        surface in display format. Rebuilt only if the color, scale, or number
+        of octaves changes.
+        """
+        key = (self.background_color, self.scale, self.num_octaves)
+        if self._background_key != key:
+            # Defines octave surface
+            octave_image = self._load_image(Paths.OCTAVE, cache=True)
+            self._octave_size = octave_image.get_size()
+            self._octave_rects = [
+                pygame.Rect((octave * self._octave_size[0], 0), self._octave_size)
+                for octave in range(self.num_octaves)
+            ]
+            # Fills background with background color
+            background = pygame.Surface(self._window.get_size())
+            background.fill(self.background_color)
+            # Draws every octave of base piano
+            for rectangle in self._octave_rects:
+                background.blit(octave_image, rectangle)
+            # Reloads key images if scale has changed since they were packed
+            if self._key_scale != self.scale:
+                self._load_key_atlas(
+                    self._load_image(path) for path in self._get_key_paths()
+                )
+            # Positions every key within every octave
+            self._key_rects = [
+                [bounds.move(rectangle.x, 0) for bounds in self._key_bounds]
+                for rectangle in self._octave_rects
+            ]
+            # Converts without alpha so blits skip blending
+            self._background = background.convert()
+            self._background_key = key
+        return self._background
 
     def tick(self, frame_rate: int = Defaults.FRAME_RATE) -> None:
         """
         Delays by amount of time nessesary to maintain specified frame rate.
+        Sleeps for most of the delay, then spins through the last moment so
+        frames are not late by the sleep's jitter.
         """
-        self._clock.tick(frame_rate)
-
-    def __del__(self) -> None:
+        # Schedules next tick against a monotonic deadline
+        self._next_tick += 1 / frame_rate
+        delay = self._next_tick - time.perf_counter()
+        # Resyncs deadline if behind
+        if delay <= 0:
+            self._next_tick = time.perf_counter()
+            return
+        if delay > Defaults.SPIN_TIME:
+            time.sleep(delay - Defaults.SPIN_TIME)
+        # Yields between checks so input threads are not held up
+        while time.perf_counter() < self._next_tick:
+            time.sleep(0)
+
+    def __enter__(self) -> "Display":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
         self.close()
 
     def close(self) -> None:
@@ -209,31 +426,28 @@ class Display:
         """
         Returns true if window is closed.
         """
-        # For every event in pygame:
-        if pygame.event.peek(pygame.QUIT):
-            return True
-        # Otherwise, return false
-        return False
+        # Checks for a queued quit event without consuming the queue
+        return pygame.event.peek(pygame.QUIT)
 
 
 if __name__ == "__main__":
-    # Creates a display
-    display = Display()
-
-    time.sleep(0.5)
-    display.update_key(Keystroke("C", 5))
-    time.sleep(0.5)
-    display.update_key(Keystroke("C", 5, press=False))
-    time.sleep(0.5)
-    display.update_key(Keystroke("D", 5))
-    display.update_key(Keystroke("F", 5))
-    display.update_key(Keystroke("F#", 5))
-    display.update_key(Keystroke("A", 4))
-
-    # Keeps display running until closed
-    while True:
-
-        if display.is_closed():
-            break
-        display.refresh()
-        display.tick()
+    # Creates a display, closed once the window is closed
+    with Display() as display:
+
+        time.sleep(0.5)
+        display.update_key(Keystroke("C", 5))
+        time.sleep(0.5)
+        display.update_key(Keystroke("C", 5, press=False))
+        time.sleep(0.5)
+        display.update_key(Keystroke("D", 5))
+        display.update_key(Keystroke("F", 5))
+        display.update_key(Keystroke("F#", 5))
+        display.update_key(Keystroke("A", 4))
+
+        # Keeps display running until closed
+        while True:
+
+            if display.is_closed():
+                break
+            display.refresh_if_changed()
+            display.tick()